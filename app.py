@@ -1,19 +1,22 @@
 # app.py
 
-import os
 import asyncio
-import uuid
+import re
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
+from dotenv import set_key
 from textual.app import App, ComposeResult
 from textual.widgets import Header, Footer, Input, Static, Select
 from textual.containers import Horizontal
 from textual.binding import Binding
 from clockify_api import ClockifyAPI
-from week_utils import get_week_dates, is_future_date
+from week_utils import get_week_dates, is_future_date, utc_today
 from debug import debug
+from env_utils import ENV_PATH, get_env
 
-load_dotenv()
+# Hours as typed in the day inputs: "8", "1.5", ".5" or "2."
+HOURS_PATTERN = re.compile(r'(\d*)(?:\.(\d*))?')
 
 class ClockifyTUI(App):
     CSS_PATH = "app.css"
@@ -28,61 +31,214 @@ class ClockifyTUI(App):
         Binding("ctrl+right", "next_week", "Week", priority=True),
     ]
     
+    # Widget IDs, the widgets are created once in compose
+    SELECT_ID = "project_select"
+    WEEK_LABEL_ID = "week_label"
+    DAYS_CONTAINER_ID = "days_container"
+    
+    # Seconds to wait after the last week navigation before fetching entries
+    WEEK_NAV_DEBOUNCE = 0.15
+    # Number of (project, week) entry lookups to keep around
+    ENTRIES_CACHE_SIZE = 8
+    # Seconds a cached week is trusted before it is fetched again
+    ENTRIES_CACHE_MAX_AGE = 60
+    # Lower bound for CLOCKIFY_POLL_INTERVAL, to stay well below Clockify's rate limit
+    MIN_POLL_INTERVAL = 10
+    
     def __init__(self):
         super().__init__()
         self.api = ClockifyAPI()
-        self.projects = self.api.get_projects()
-        # Filter out archived projects
-        self.projects = [p for p in self.projects if not p.get('archived', False)]
+        # Projects are loaded in on_mount, together with the workspace and user
+        self.projects = []
+        self._projects_by_id = {}
         self.selected_project_id = None
         self.selected_project_name = None
         self.week_offset = 0
         self.inputs = []
         self.prefilled_hours = {}
+        # The project and week the inputs currently show, set by _apply_week
+        self._shown_project_id = None
+        self._shown_week = None
+        self._refresh_task = None
+        # (fetch time, booked minutes per day), keyed by (project_id, week start),
+        # most recent last
+        self._entries_cache = OrderedDict()
+        self._prefetch_tasks = {}
+        self._poll_task = None
+        self._last_fetch = 0
+        self._submitting = False
+        # Bumped by every refresh and submit, so a poll that raced with one of
+        # them can tell its result is outdated
+        self._data_generation = 0
         
         # Try to load default project from environment variable
-        default_project_id = os.getenv("DEFAULT_PROJECT_ID")
+        default_project_id = get_env().get("DEFAULT_PROJECT_ID")
         if default_project_id:
             self.selected_project_id = default_project_id
-            # Set the project name
-            for project in self.projects:
-                if project['id'] == self.selected_project_id:
-                    self.selected_project_name = project['clientName']
-                    break
-                    
-        self._refresh_widget_ids()
+            
+        # Optionally re-fetch the shown week every CLOCKIFY_POLL_INTERVAL seconds
+        try:
+            poll_interval = float(get_env().get("CLOCKIFY_POLL_INTERVAL") or 0)
+        except ValueError:
+            poll_interval = 0
+        self.poll_interval = max(poll_interval, self.MIN_POLL_INTERVAL) if poll_interval > 0 else 0
 
-    def _refresh_widget_ids(self):
-        """Generate new unique IDs for all widgets"""
-        self._select_id = f"project_select_{uuid.uuid4().hex[:8]}"
-        self._week_label_id = f"week_label_{uuid.uuid4().hex[:8]}"
-        self._horizontal_id = f"days_container_{uuid.uuid4().hex[:8]}"
-    
     async def refresh_ui_with_data(self):
         """Helper function to refresh the UI with current data and focus on the first input"""
-        week = get_week_dates(self.week_offset)
+        # Use one date for the week and its future-day check, even across midnight
+        today = utc_today()
+        week = get_week_dates(self.week_offset, today)
+        project_id = self.selected_project_id
+        self._data_generation += 1
+        generation = self._data_generation
         
         # Only fetch data if we have a selected project
-        if self.selected_project_id:
-            self.prefilled_hours = self.api.get_time_entries(self.selected_project_id, week)
+        if project_id:
+            entries = await self._get_week_entries(project_id, week)
+            # A newer refresh, project change or week navigation happened while
+            # fetching, don't overwrite the UI with data for the old selection
+            if (generation != self._data_generation
+                    or project_id != self.selected_project_id
+                    or week != get_week_dates(self.week_offset, today)):
+                return
+            self.prefilled_hours = entries
             
-        self._refresh_widget_ids()
-        await self.reset_ui()
+        self._apply_project_selection()
         
-        # Focus on the first input field if available
-        if self.inputs and len(self.inputs) > 0:
+        # Fill in the week and focus on its first input if a project is selected
+        if project_id:
+            self._apply_week(project_id, week, self.prefilled_hours, today)
             self.set_focus(self.inputs[0])
+            # The previous or next week is the most likely one to be viewed next
+            self._prefetch_adjacent_weeks()
+        
+    async def _get_week_entries(self, project_id, week):
+        """Get the booked minutes per day for a week, using prefetched data when available"""
+        key = (project_id, week[0])
+        prefetch = self._prefetch_tasks.get(key)
+        if prefetch:
+            # Wait for the running prefetch instead of fetching the week twice
+            await asyncio.wait({prefetch})
+        entries = self._cached_week_entries(key)
+        if entries is not None:
+            return entries
+            
+        entries = await self.api.get_time_entries(project_id, week)
+        self._last_fetch = time.monotonic()
+        self._cache_week_entries(key, entries)
+        return entries
+
+    def _cached_week_entries(self, key):
+        """Return the cached entries for a week, or None if missing or too old"""
+        cached = self._entries_cache.get(key)
+        if cached is None:
+            return None
+        fetched_at, entries = cached
+        if time.monotonic() - fetched_at > self.ENTRIES_CACHE_MAX_AGE:
+            del self._entries_cache[key]
+            return None
+        self._entries_cache.move_to_end(key)
+        return entries
+
+    def _cache_week_entries(self, key, entries):
+        self._entries_cache[key] = (time.monotonic(), entries)
+        self._entries_cache.move_to_end(key)
+        while len(self._entries_cache) > self.ENTRIES_CACHE_SIZE:
+            self._entries_cache.popitem(last=False)
+
+    def _prefetch_adjacent_weeks(self):
+        """Fetch the weeks around the current one in the background"""
+        for offset in (self.week_offset - 1, self.week_offset + 1):
+            week = get_week_dates(offset)
+            key = (self.selected_project_id, week[0])
+            if key in self._prefetch_tasks or self._cached_week_entries(key) is not None:
+                continue
+            task = asyncio.create_task(self._prefetch_week(key, week))
+            self._prefetch_tasks[key] = task
+            task.add_done_callback(lambda _, key=key: self._prefetch_tasks.pop(key, None))
+
+    async def _prefetch_week(self, key, week):
+        try:
+            entries = await self.api.get_time_entries(key[0], week)
+        except Exception as e:
+            # Prefetching is best effort, the week is fetched again when viewed
+            debug(f"Prefetch of week {week[0].isoformat()} failed", str(e))
+            return
+        self._cache_week_entries(key, entries)
+        
+    def _schedule_week_refresh(self):
+        """Refresh the week after a short delay, replacing any pending refresh"""
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+        self._refresh_task = asyncio.create_task(self._debounced_refresh(self.WEEK_NAV_DEBOUNCE))
+
+    async def _debounced_refresh(self, delay):
+        await asyncio.sleep(delay)
+        try:
+            await self.refresh_ui_with_data()
+        except Exception as e:
+            # Nothing awaits this task, so report the failure here
+            debug("Week refresh failed", str(e))
+            self.notify("Could not load this week, please try again", severity="error")
+        
+    async def _poll_loop(self):
+        """Pick up changes made elsewhere (e.g. the Clockify web app) to the shown week"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if self._submitting or not self.selected_project_id:
+                continue
+            # Skip if the week was fetched recently anyway, or is being refreshed
+            if time.monotonic() - self._last_fetch < self.poll_interval:
+                continue
+            if self._refresh_task and not self._refresh_task.done():
+                continue
+            # Never overwrite hours the user is still editing
+            if self._has_unsaved_changes():
+                continue
+                
+            project_id = self.selected_project_id
+            week = get_week_dates(self.week_offset)
+            generation = self._data_generation
+            try:
+                entries = await self.api.get_time_entries(project_id, week)
+            except Exception as e:
+                debug("Polling time entries failed", str(e))
+                continue
+            # A refresh or submit happened meanwhile, its data is newer than ours
+            if generation != self._data_generation:
+                continue
+            self._last_fetch = time.monotonic()
+            self._cache_week_entries((project_id, week[0]), entries)
+            
+            # Only update the inputs if the user is still looking at the same week
+            # and hasn't started editing in the meantime
+            if project_id != self.selected_project_id or week != get_week_dates(self.week_offset):
+                continue
+            if entries != self.prefilled_hours and not self._has_unsaved_changes():
+                self.prefilled_hours = entries
+                self._apply_week(project_id, week, entries)
+
+    def _has_unsaved_changes(self):
+        week = get_week_dates(self.week_offset)
+        return any(
+            inp.value != self.format_minutes(self.prefilled_hours.get(date, 0))
+            for inp, date in zip(self.inputs, week)
+        )
         
     async def on_select_changed(self, event: Select.Changed) -> None:
+        # A pending week refresh is for the previous project
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
         self.selected_project_id = event.value
         # Store the project name for display purposes
-        for project in self.projects:
-            if project['id'] == self.selected_project_id:
-                self.selected_project_name = project['clientName']
-                break
+        self._resolve_selected_project_name()
                 
         await self.refresh_ui_with_data()
     
+    def _resolve_selected_project_name(self):
+        project = self._projects_by_id.get(self.selected_project_id)
+        self.selected_project_name = project['clientName'] if project else None
+    
     def format_minutes(self, minutes):
         """Convert minutes to a formatted string (e.g., 90 -> 1.5)"""
         if minutes == 0:
@@ -94,125 +250,71 @@ class ClockifyTUI(App):
         return str(round(hours, 1))
     
     def save_default_project(self):
-        """Save the currently selected project as default in .env file"""
+        """Save the currently selected project as default in .env file, returns whether it was saved"""
         if not self.selected_project_id:
-            return
+            return False
             
-        # Read current .env file
-        env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
-        env_content = ""
-        
-        # Try to read existing content
-        try:
-            with open(env_path, 'r') as f:
-                env_content = f.read()
-        except FileNotFoundError:
-            pass
-            
-        # Update or add DEFAULT_PROJECT_ID
-        if "DEFAULT_PROJECT_ID" in env_content:
-            lines = env_content.splitlines()
-            updated_lines = []
-            for line in lines:
-                if line.startswith("DEFAULT_PROJECT_ID="):
-                    updated_lines.append(f"DEFAULT_PROJECT_ID={self.selected_project_id}")
-                else:
-                    updated_lines.append(line)
-            env_content = "\n".join(updated_lines)
-        else:
-            if env_content and not env_content.endswith("\n"):
-                env_content += "\n"
-            env_content += f"DEFAULT_PROJECT_ID={self.selected_project_id}\n"
+        # Leave anything that isn't a regular file (like a FIFO) alone
+        if ENV_PATH.exists() and not ENV_PATH.is_file():
+            return False
             
-        # Write back to file
-        with open(env_path, 'w') as f:
-            f.write(env_content)
+        # Update or add DEFAULT_PROJECT_ID, leaving the rest of the file as is
+        set_key(ENV_PATH, "DEFAULT_PROJECT_ID", self.selected_project_id, quote_mode="never")
+        return True
 
-    async def reset_ui(self) -> None:
-        """Completely reset and rebuild the UI"""
-        # Remove all widgets first
-        self.query("*").remove()
+    def _apply_project_selection(self):
+        """Show the selected project in the selector and toggle the week content"""
+        project_select = self.query_one(f"#{self.SELECT_ID}", Select)
+        with project_select.prevent(Select.Changed):
+            project_select.prompt = self.selected_project_name or "Select"
+            if self.selected_project_id in self._projects_by_id:
+                project_select.value = self.selected_project_id
         
-        # Add the basic elements
-        header = Header()
-        self.mount(header)
-        
-        # Create the project selector with a dynamic ID
-        options = [(p['clientName'], p['id']) for p in self.projects]
-        
-        # Create select with proper prompt text that shows selected project name
-        prompt = "Select"
+        # Only show the week content if a project is selected
+        show_week = bool(self.selected_project_id)
+        self.query_one(f"#{self.WEEK_LABEL_ID}", Static).display = show_week
+        self.query_one(f"#{self.DAYS_CONTAINER_ID}", Horizontal).display = show_week
+
+    def _apply_week(self, project_id, week, prefilled, today=None):
+        """Show the given week and fill the day inputs with its booked hours"""
+        # Week label with project name, centered
+        label_text = f"Week: {week[0].strftime('%b %d')} - {week[-1].strftime('%b %d')}"
         if self.selected_project_name:
-            prompt = self.selected_project_name
-            
-        project_select = Select(
-            options=options, 
-            id=self._select_id,
-            prompt=prompt
-        )
-        
-        if self.selected_project_id:
-            # We need to find the matching index to ensure the dropdown shows the right value
-            for i, (name, id) in enumerate(options):
-                if id == self.selected_project_id:
-                    project_select.value = id
-                    project_select.highlighted = i
-                    break
+            label_text = f"{self.selected_project_name} - {label_text}"
+        self.query_one(f"#{self.WEEK_LABEL_ID}", Static).update(label_text)
+        self._shown_project_id = project_id
+        self._shown_week = week
         
-        self.mount(project_select)
-        
-        # Add the week content if a project is selected
-        if self.selected_project_id:
-            week = get_week_dates(self.week_offset)
-            
-            # Week label with project name, centered
-            label_text = f"Week: {week[0].strftime('%b %d')} - {week[-1].strftime('%b %d')}"
-            if self.selected_project_name:
-                label_text = f"{self.selected_project_name} - {label_text}"
-                
-            week_label = Static(label_text, id=self._week_label_id, classes="centered")
-            self.mount(week_label)
-            
-            # Day inputs
-            days = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-            self.inputs = []
-            day_inputs = []
-            for i, day in enumerate(days):
-                date = week[i]
-                disabled = is_future_date(date)
-                prefill_value = ""
-                if date in self.prefilled_hours:
-                    prefill_value = self.format_minutes(self.prefilled_hours[date])
-                inp_id = f"day_{i}_{uuid.uuid4().hex[:6]}"
-                inp = Input(placeholder=day, id=inp_id, value=prefill_value, disabled=disabled)
-                self.inputs.append(inp)
-                day_inputs.append(inp)
-            
-            horizontal = Horizontal(*day_inputs, id=self._horizontal_id)
-            self.mount(horizontal)
-        
-        # Add footer
-        footer = Footer()
-        self.mount(footer)
+        if today is None:
+            today = utc_today()
+        for inp, date in zip(self.inputs, week):
+            inp.disabled = is_future_date(date, today)
+            inp.value = self.format_minutes(prefilled.get(date, 0))
 
     def compose(self) -> ComposeResult:
         yield Header()
         
-        options = [(p['clientName'], p['id']) for p in self.projects]
-        prompt = "Select"
-        if self.selected_project_name:
-            prompt = self.selected_project_name
-            
-        select = Select(
-            options=options, 
-            id=self._select_id,
-            prompt=prompt
+        # The project options are filled in on mount, once they are loaded
+        yield Select(
+            options=[], 
+            id=self.SELECT_ID,
+            prompt=self.selected_project_name or "Select"
         )
         
-        if self.selected_project_id:
-            select.value = self.selected_project_id
-            
-        yield select
+        # The week content stays hidden until _apply_project_selection shows it
+        week_label = Static("", id=self.WEEK_LABEL_ID, classes="centered")
+        week_label.display = False
+        yield week_label
+        
+        # Day inputs
+        days = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+        self.inputs = [
+            Input(placeholder=day, id=f"day_{i}")
+            for i, day in enumerate(days)
+        ]
+        days_container = Horizontal(*self.inputs, id=self.DAYS_CONTAINER_ID)
+        days_container.display = False
+        yield days_container
 
         yield Footer()
     
@@ -222,19 +324,22 @@ class ClockifyTUI(App):
         """Navigate to the previous week"""
         self.week_offset -= 1
         if self.selected_project_id:
-            await self.refresh_ui_with_data()
+            self._schedule_week_refresh()
             
     async def action_next_week(self) -> None:
         """Navigate to the next week"""
         self.week_offset += 1
         if self.selected_project_id:
-            await self.refresh_ui_with_data()
+            self._schedule_week_refresh()
             
     async def action_set_default(self) -> None:
         """Set current project as default"""
         if self.selected_project_id:
-            self.save_default_project()
-            self.notify("Default project set!")
+            # Writing .env is blocking file I/O, keep it off the event loop
+            if await asyncio.to_thread(self.save_default_project):
+                self.notify("Default project set!")
+            else:
+                self.notify(f"Could not save default project, {ENV_PATH} is not a regular file", severity="error")
             
     async def action_submit(self) -> None:
         """Submit hours for the current week"""
@@ -245,7 +350,7 @@ class ClockifyTUI(App):
         focused = self.focused
         if focused and any(inp == focused for inp in self.inputs):
             # If focus is on an input, move focus back to project select
-            self.set_focus(self.query_one(f"#{self._select_id}"))
+            self.set_focus(self.query_one(f"#{self.SELECT_ID}"))
         else:
             # Otherwise exit the application
             self.exit()
@@ -254,9 +359,17 @@ class ClockifyTUI(App):
         """Submit hours for the current week"""
         if not self.selected_project_id:
             return
+        # Let a pending week refresh finish, it reports its own errors
+        if self._refresh_task and not self._refresh_task.done():
+            await asyncio.wait({self._refresh_task})
         project_id = self.selected_project_id
         week = get_week_dates(self.week_offset)
-        changes_made = False
+        # Never submit the inputs of one week under the dates of another
+        if self._shown_project_id != project_id or self._shown_week != week:
+            self.notify("This week hasn't loaded yet, nothing submitted", severity="error")
+            return
+        tasks = []
+        invalid_days = []
         
         for i, inp in enumerate(self.inputs):
             date = week[i]
@@ -265,6 +378,10 @@ class ClockifyTUI(App):
                 continue
                 
             minutes = self.parse_hours(val)
+            # Leave days with invalid input alone rather than guessing
+            if minutes is None:
+                invalid_days.append(inp.placeholder)
+                continue
             
             # Check if we had a previous value for this day
             had_previous_value = date in self.prefilled_hours and self.prefilled_hours[date] > 0
@@ -272,42 +389,92 @@ class ClockifyTUI(App):
             # Only make API calls if there's a change
             if minutes == 0 and had_previous_value:
                 # Delete existing entry if the new value is 0
-                self.api.delete_time_entry(project_id, date)
-                changes_made = True
+                tasks.append(self.api.delete_time_entry(project_id, date))
             elif minutes > 0:
-                # Submit only if the value has changed
-                if not had_previous_value or minutes != self.prefilled_hours[date]:
-                    self.api.book_time(project_id, date, minutes)
-                    changes_made = True
+                # Submit only if the value has changed; existing entries
+                # must be removed first to avoid duplicates
+                if not had_previous_value:
+                    tasks.append(self.api.book_time(project_id, date, minutes))
+                elif minutes != self.prefilled_hours[date]:
+                    tasks.append(self.api.rebook_time(project_id, date, minutes))
         
+        if invalid_days:
+            self.notify(f"Invalid hours for {', '.join(invalid_days)}, skipped", severity="warning")
+            
         # Only refresh UI if changes were made
-        if changes_made:
+        if not tasks:
+            if not invalid_days:
+                self.notify("No changes to submit")
+            return
+            
+        # Send all changed days at once instead of one after the other
+        self._submitting = True
+        self._data_generation += 1
+        try:
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            self._entries_cache.pop((project_id, week[0]), None)
+            errors = [r for r in results if isinstance(r, Exception)]
+            for error in errors:
+                debug("submit_hours error", str(error))
+                
             await self.refresh_ui_with_data()
-            self.notify("Hours submitted successfully!")
+        finally:
+            self._submitting = False
+        if errors:
+            self.notify(f"{len(errors)} of {len(tasks)} changes failed, please try again", severity="error")
         else:
-            self.notify("No changes to submit")
+            self.notify("Hours submitted successfully!")
 
     def parse_hours(self, text):
-        """Convert hours text input to minutes"""
+        """Convert hours text input (e.g. "1.5" or "1,5") to minutes, None if it isn't valid"""
         if not text:
             return 0
             
         # Replace comma with dot for decimal
-        text = text.replace(",", ".")
-        
-        try:
-            # Try to parse as float
-            hours = float(text)
-            # Convert hours to minutes (rounded to nearest minute)
-            return round(hours * 60)
-        except ValueError:
-            return 0
+        match = HOURS_PATTERN.fullmatch(text.strip().replace(",", ".", 1))
+        if not match:
+            return None
+        whole, fraction = match.group(1), match.group(2) or ""
+        if not whole and not fraction:
+            return None
+            
+        # Convert hours to minutes with integer arithmetic (rounded to nearest minute)
+        minutes = int(whole or 0) * 60
+        if fraction:
+            scale = 10 ** len(fraction)
+            fraction_minutes, remainder = divmod(int(fraction) * 60, scale)
+            minutes += fraction_minutes + (2 * remainder >= scale)
+        return minutes
 
     async def on_mount(self) -> None:
         """Called when app is mounted"""
-        # If there's a default project selected, initialize the UI
-        if self.selected_project_id:
-            await self.refresh_ui_with_data()
+        projects = await self.api.bootstrap()
+        # Filter out archived projects
+        self.projects = [p for p in projects if not p.get('archived', False)]
+        self._projects_by_id = {p['id']: p for p in self.projects}
+        options = [(p['clientName'], p['id']) for p in self.projects]
+        project_select = self.query_one(f"#{self.SELECT_ID}", Select)
+        with project_select.prevent(Select.Changed):
+            project_select.set_options(options)
+        
+        # Set the name of the default project, if any
+        self._resolve_selected_project_name()
+                    
+        # Show the default project's week, if any
+        await self.refresh_ui_with_data()
+        
+        if self.poll_interval:
+            self._poll_task = asyncio.create_task(self._poll_loop())
+
+    async def on_unmount(self) -> None:
+        """Close the API's HTTP session when the app shuts down"""
+        if self._refresh_task:
+            self._refresh_task.cancel()
+        if self._poll_task:
+            self._poll_task.cancel()
+        for task in list(self._prefetch_tasks.values()):
+            task.cancel()
+        await self.api.close()
 
 if __name__ == "__main__":
     app = ClockifyTUI()
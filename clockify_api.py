@@ -1,25 +1,42 @@
 # clockify_api.py
 
-import os
-import requests
-from datetime import datetime, timedelta
+import asyncio
+import aiohttp
+from collections import defaultdict
+import datetime as dt
 from debug import debug
-import re 
+from env_utils import get_env
+
+# Keep idle connections around long enough to survive some browsing between
+# requests, so most calls skip the TCP + TLS handshake
+KEEPALIVE_TIMEOUT = 120
+KEEPALIVE_CONNECTIONS = 10
 
 def parse_duration(duration_str):
-    if not duration_str:
-        return 0
-    # Example: PT8H -> 8 hours
-    match = re.match(r'PT(?:(\d+)H)?(?:(\d+)M)?', duration_str)
-    if not match:
+    if not duration_str or not duration_str.startswith("PT"):
         return 0
-    hours = int(match.group(1) or 0)
-    minutes = int(match.group(2) or 0)
+    # Example: PT8H -> 8 hours, PT1H30M -> 90 minutes (seconds are ignored)
+    hours = minutes = 0
+    value = None
+    seen_hours = False
+    for i in range(2, len(duration_str)):
+        char = duration_str[i]
+        if "0" <= char <= "9":
+            value = (value or 0) * 10 + ord(char) - 48
+        elif char == "H" and value is not None and not seen_hours:
+            hours = value
+            value = None
+            seen_hours = True
+        elif char == "M" and value is not None:
+            minutes = value
+            break
+        else:
+            break
     return hours * 60 + minutes
 
 class ClockifyAPI:
     def __init__(self):
-        self.api_key = os.getenv("CLOCKIFY_API_KEY")
+        self.api_key = get_env().get("CLOCKIFY_API_KEY")
         if not self.api_key:
             raise ValueError("CLOCKIFY_API_KEY not set.")
         self.base_url = "https://api.clockify.me/api/v1"
@@ -27,61 +44,102 @@ class ClockifyAPI:
             "X-Api-Key": self.api_key,
             "Content-Type": "application/json"
         }
-        self.workspace_id = self.get_workspace_id()
-        self.user_id = self.get_user_id()
+        self.workspace_id = None
+        self.user_id = None
+        self._session = None
+        # Entry ids per (project_id, date) seen by get_time_entries, so deletes
+        # don't have to fetch the day's entries again
+        self._entry_ids_by_day = {}
+
+    @property
+    def session(self):
+        """Lazily create the aiohttp session (it needs a running event loop)
+
+        All requests go through this one session so the TLS connections to
+        Clockify are pooled and kept alive between user actions.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=KEEPALIVE_CONNECTIONS,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+            )
+            self._session = aiohttp.ClientSession(headers=self.headers, connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
 
-    def get_workspace_id(self):
-        resp = requests.get(f"{self.base_url}/workspaces", headers=self.headers)
-        resp.raise_for_status()
-        return resp.json()[0]['id']
+    async def bootstrap(self):
+        """Look up the workspace, user and projects, returns the projects
 
-    def get_user_id(self):
-        resp = requests.get(f"{self.base_url}/user", headers=self.headers)
-        resp.raise_for_status()
-        return resp.json()['id']
+        The user lookup runs concurrently with the workspace + projects
+        lookups, so startup waits for two round trips instead of three.
+        """
+        async def load_workspace_and_projects():
+            self.workspace_id = await self.get_workspace_id()
+            return await self.get_projects()
 
-    def get_projects(self):
+        projects, self.user_id = await asyncio.gather(
+            load_workspace_and_projects(),
+            self.get_user_id(),
+        )
+        return projects
+
+    async def get_workspace_id(self):
+        async with self.session.get(f"{self.base_url}/workspaces") as resp:
+            resp.raise_for_status()
+            return (await resp.json())[0]['id']
+
+    async def get_user_id(self):
+        async with self.session.get(f"{self.base_url}/user") as resp:
+            resp.raise_for_status()
+            return (await resp.json())['id']
+
+    async def get_projects(self):
         url = f"{self.base_url}/workspaces/{self.workspace_id}/projects"
         debug(f"GET {url}")
-        resp = requests.get(url, headers=self.headers)
-        debug("Response", resp.json())
-        resp.raise_for_status()
-        return resp.json()
+        async with self.session.get(url) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+            debug("Response", data)
+            return data
 
 
-    def get_time_entries(self, project_id, week_dates):
+    async def get_time_entries(self, project_id, week_dates):
         start = week_dates[0].isoformat() + "T00:00:00Z"
         end = week_dates[-1].isoformat() + "T23:59:59Z"
         url = f"{self.base_url}/workspaces/{self.workspace_id}/user/{self.user_id}/time-entries"
-        params = {"start": start, "end": end}
-        resp = requests.get(url, headers=self.headers, params=params)
-        resp.raise_for_status()
-        entries = resp.json()
-        debug("get_time_entries Response", resp.json())
-
-        # Group minutes by day
-        day_minutes = {}
+        # Let Clockify filter on project, so only this project's entries are sent
+        params = {"start": start, "end": end, "project": project_id}
+        async with self.session.get(url, params=params) as resp:
+            resp.raise_for_status()
+            entries = await resp.json()
+            debug("get_time_entries Response", entries)
+
+        # Group minutes and entry ids by day
+        day_minutes = defaultdict(int)
+        for day in week_dates:
+            self._entry_ids_by_day[(project_id, day)] = []
         for entry in entries:
+            # The server already filtered on project, this only guards against
+            # entries without a projectId slipping through
             if entry.get('projectId') != project_id:
                 continue
-            start_time = datetime.fromisoformat(entry['timeInterval']['start'].replace('Z', '+00:00'))
-            duration_str = entry['timeInterval'].get('duration')
-            minutes = parse_duration(duration_str)
-            day = start_time.date()
-            day_minutes[day] = day_minutes.get(day, 0) + minutes
-        return day_minutes
-
-    def book_time(self, project_id, date, minutes):
+            time_interval = entry['timeInterval']
+            # Start times are UTC ("2024-01-15T09:00:00Z"), the date prefix is the day
+            day = dt.date.fromisoformat(time_interval['start'][:10])
+            day_minutes[day] += parse_duration(time_interval.get('duration'))
+            self._entry_ids_by_day.setdefault((project_id, day), []).append(entry['id'])
+        return dict(day_minutes)
+
+    async def book_time(self, project_id, date, minutes):
         if minutes <= 0:
             return
             
-        # First delete any existing entries for this date and project
-        # to avoid duplicate entries
-        self.delete_time_entry(project_id, date)
-        
         # Use 9:00 AM as a standard start time instead of midnight
-        start_time = datetime.combine(date, datetime.min.time()) + timedelta(hours=9)
-        end_time = start_time + timedelta(minutes=minutes)
+        start_time = dt.datetime.combine(date, dt.datetime.min.time()) + dt.timedelta(hours=9)
+        end_time = start_time + dt.timedelta(minutes=minutes)
 
         payload = {
             "start": start_time.isoformat() + "Z",
@@ -91,28 +149,45 @@ class ClockifyAPI:
             "projectId": project_id,
             "workspaceId": self.workspace_id
         }
-        resp = requests.post(f"{self.base_url}/workspaces/{self.workspace_id}/time-entries", headers=self.headers, json=payload)
-        resp.raise_for_status()
-        return resp.json()
+        url = f"{self.base_url}/workspaces/{self.workspace_id}/time-entries"
+        async with self.session.post(url, json=payload) as resp:
+            resp.raise_for_status()
+            self._entry_ids_by_day.pop((project_id, date), None)
+            return await resp.json()
+
+    async def rebook_time(self, project_id, date, minutes):
+        """Replace existing entries for this date and project with a new booking"""
+        await self.delete_time_entry(project_id, date)
+        return await self.book_time(project_id, date, minutes)
 
-    def delete_time_entry(self, project_id, date):
+    async def _delete_entry(self, entry_id):
+        delete_url = f"{self.base_url}/workspaces/{self.workspace_id}/time-entries/{entry_id}"
+        async with self.session.delete(delete_url) as resp:
+            # Already deleted elsewhere (e.g. the Clockify web app), nothing left to do
+            if resp.status == 404:
+                return
+            resp.raise_for_status()
+
+    async def delete_time_entry(self, project_id, date):
         """Delete time entries for a specific project and date"""
-        # First get the time entries for the date
+        entry_ids = self._entry_ids_by_day.pop((project_id, date), None)
+        if entry_ids is None:
+            entry_ids = await self._fetch_entry_ids(project_id, date)
+        
+        # Delete all entries that match the project_id concurrently
+        await asyncio.gather(*(self._delete_entry(entry_id) for entry_id in entry_ids))
+        for entry_id in entry_ids:
+            debug(f"Deleted time entry {entry_id} for {date.isoformat()}")
+
+    async def _fetch_entry_ids(self, project_id, date):
+        """Get the ids of the time entries for a specific project and date"""
         start = date.isoformat() + "T00:00:00Z"
         end = date.isoformat() + "T23:59:59Z"
         url = f"{self.base_url}/workspaces/{self.workspace_id}/user/{self.user_id}/time-entries"
-        params = {"start": start, "end": end}
-        
-        resp = requests.get(url, headers=self.headers, params=params)
-        resp.raise_for_status()
-        entries = resp.json()
+        # Let Clockify filter on project, so only this project's entries are sent
+        params = {"start": start, "end": end, "project": project_id}
         
-        # Delete each entry that matches the project_id
-        for entry in entries:
-            if entry.get('projectId') == project_id:
-                entry_id = entry['id']
-                delete_url = f"{self.base_url}/workspaces/{self.workspace_id}/time-entries/{entry_id}"
-                delete_resp = requests.delete(delete_url, headers=self.headers)
-                delete_resp.raise_for_status()
-                debug(f"Deleted time entry {entry_id} for {date.isoformat()}")
-
+        async with self.session.get(url, params=params) as resp:
+            resp.raise_for_status()
+            entries = await resp.json()
+        return [entry['id'] for entry in entries if entry.get('projectId') == project_id]
@@ -0,0 +1,19 @@
+# env_utils.py
+
+import os
+import pathlib
+import functools
+from dotenv import load_dotenv
+
+# The .env file next to the app
+ENV_PATH = pathlib.Path(__file__).resolve().parent / ".env"
+
+@functools.cache
+def get_env():
+    """Load the .env file once and return a snapshot of the environment"""
+    # Only read regular files, opening a FIFO (e.g. one served by a
+    # password manager) would block until something writes to it
+    if ENV_PATH.is_file():
+        with ENV_PATH.open() as f:
+            load_dotenv(stream=f)
+    return dict(os.environ)
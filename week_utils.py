@@ -1,13 +1,18 @@
 # week_utils.py
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
-def get_week_dates(offset_weeks=0):
-    today = datetime.utcnow().date()
+def utc_today():
+    return datetime.now(timezone.utc).date()
+
+def get_week_dates(offset_weeks=0, today=None):
+    if today is None:
+        today = utc_today()
     start_of_week = today - timedelta(days=today.weekday())
     start_of_week += timedelta(weeks=offset_weeks)
     return [start_of_week + timedelta(days=i) for i in range(7)]
 
-def is_future_date(date):
-    today = datetime.utcnow().date()
+def is_future_date(date, today=None):
+    if today is None:
+        today = utc_today()
     return date > today